@@ -9,7 +9,10 @@ Run this on your local Mac and configure the tvOS app to connect to it.
 Now includes comprehensive analytics logging for future recommendation algorithms.
 
 Requirements:
-    pip3 install yt-dlp flask
+    pip3 install "yt-dlp[default]" flask
+
+Optional (faster analytics JSON encoding/decoding, multi-threaded server):
+    pip3 install orjson waitress
 
 Usage:
     python3 yt_server.py
@@ -28,51 +31,845 @@ Example:
 """
 
 import argparse
+import atexit
+import gzip
+import hashlib
+import heapq
+import importlib
+import importlib.util
 import json
 import os
+import re
+import sqlite3
 import subprocess
 import sys
+import threading
+import time
 import uuid
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import date, datetime, timedelta
+from email.utils import formatdate
 from functools import lru_cache
-from datetime import datetime, timedelta
 from pathlib import Path
 
 try:
-    from flask import Flask, jsonify, request
+    from flask import Flask, Response, jsonify, request, stream_with_context
 except ImportError:
     print("Flask not installed. Installing...")
     subprocess.check_call([sys.executable, "-m", "pip", "install", "flask"])
-    from flask import Flask, jsonify, request
+    from flask import Flask, Response, jsonify, request, stream_with_context
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-# Find yt-dlp executable (check venv first, then system PATH)
+# Prefer running yt-dlp in-process; fall back to the yt-dlp executable
+# (venv first, then system PATH) when this interpreter can't import it.
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 VENV_YTDLP = os.path.join(SCRIPT_DIR, "venv", "bin", "yt-dlp")
+YTDLP_PATH = None
+
+try:
+    from yt_dlp import YoutubeDL
+    from yt_dlp.utils import DownloadError
+    from yt_dlp.version import __version__ as YTDLP_VERSION
+    print(f"Using yt-dlp library {YTDLP_VERSION}")
+except ImportError:
+    YoutubeDL = None
 
-if os.path.exists(VENV_YTDLP):
-    YTDLP_PATH = VENV_YTDLP
-    print(f"Using venv yt-dlp: {YTDLP_PATH}")
-else:
-    # Try system PATH
-    import shutil
-    YTDLP_PATH = shutil.which("yt-dlp")
-    if not YTDLP_PATH:
-        print("yt-dlp not found. Installing to venv...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "yt-dlp"])
-        YTDLP_PATH = VENV_YTDLP if os.path.exists(VENV_YTDLP) else "yt-dlp"
+    class DownloadError(Exception):
+        """Raised when the yt-dlp executable exits with an error."""
+
+    if os.path.exists(VENV_YTDLP):
+        YTDLP_PATH = VENV_YTDLP
+        print(f"Using venv yt-dlp: {YTDLP_PATH}")
     else:
-        print(f"Using system yt-dlp: {YTDLP_PATH}")
+        # Try system PATH
+        import shutil
+        YTDLP_PATH = shutil.which("yt-dlp")
+        if not YTDLP_PATH:
+            print("yt-dlp not found. Installing...")
+            subprocess.check_call([sys.executable, "-m", "pip", "install", "yt-dlp[default]"])
+            importlib.invalidate_caches()
+            from yt_dlp import YoutubeDL
+            from yt_dlp.utils import DownloadError
+            from yt_dlp.version import __version__ as YTDLP_VERSION
+            print(f"Using yt-dlp library {YTDLP_VERSION}")
+        else:
+            print(f"Using system yt-dlp: {YTDLP_PATH}")
+
+# yt-dlp only keeps HTTPS connections alive (pooled per YoutubeDL instance)
+# through its requests-based handler. With the long-lived instances used
+# below, that lets repeat extractions skip the TCP/TLS handshake to YouTube.
+if YoutubeDL is not None and importlib.util.find_spec("requests") is None:
+    print('[Warning] "requests" is not installed, so yt-dlp opens a new connection '
+          'for every request. Install it with: pip3 install "yt-dlp[default]"')
 
 app = Flask(__name__)
 
-# Simple cache for video URLs (they expire, so cache for 1 hour max)
-url_cache = {}
-CACHE_DURATION = timedelta(hours=1)
+
+def _dumps(obj) -> bytes:
+    """Encode obj as compact JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson rejects a few inputs json accepts (e.g. ints over 64 bits)
+            pass
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def _loads(data):
+    """
+    Parse JSON from str or bytes, using orjson when it is installed.
+
+    Anything orjson rejects is retried with json, mirroring _dumps, so
+    lines _dumps had to write with json still read back. Callers catch
+    json.JSONDecodeError, which orjson.JSONDecodeError subclasses.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+# Largest ID accepted from a URL into the logs. orjson can't write wider
+# integers, and depending on its version reads them back as floats or not
+# at all, which would break replaying the entry.
+MAX_LOGGED_INT = (1 << 63) - 1
+
+
+if orjson is not None:
+    try:
+        from flask.json.provider import DefaultJSONProvider
+    except ImportError:  # Flask < 2.2 has no pluggable JSON provider
+        DefaultJSONProvider = None
+
+    if DefaultJSONProvider is not None:
+        class OrjsonJSONProvider(DefaultJSONProvider):
+            """Flask JSON provider that parses request bodies and encodes jsonify() with orjson."""
+
+            def dumps(self, obj, **kwargs):
+                # separators is always passed for compact output, which orjson produces anyway
+                if "indent" not in kwargs:
+                    option = orjson.OPT_NON_STR_KEYS
+                    if self.sort_keys:
+                        option |= orjson.OPT_SORT_KEYS
+                    try:
+                        return orjson.dumps(obj, default=self.default, option=option).decode()
+                    except TypeError:
+                        pass
+                return super().dumps(obj, **kwargs)
+
+            def loads(self, s, **kwargs):
+                if kwargs:
+                    return super().loads(s, **kwargs)
+                return orjson.loads(s)
+
+        app.json = OrjsonJSONProvider(app)
+
+# jsonify() output is never pretty-printed, even if debug is switched on
+try:
+    app.json.compact = True
+except AttributeError:  # Flask < 2.2
+    app.config["JSONIFY_PRETTYPRINT_REGULAR"] = False
+
+
+class LRUTTL:
+    """
+    Thread-safe cache bounded by both entry count and age.
+
+    Entries expire ttl seconds after they are set (or after a per-entry ttl
+    passed to set()); once capacity is exceeded the least recently used
+    entry is evicted. Expired entries are swept off an expiry heap on every
+    access, so entries that are never looked up again don't linger until
+    LRU eviction.
+    """
+
+    def __init__(self, capacity: int, ttl: float):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value), LRU first
+        # Min-heap of (expires_at, key). Entries for keys since re-set or
+        # evicted are stale and skipped when they reach the top.
+        self._expiry = []
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired."""
+        with self._lock:
+            self._sweep(time.monotonic())
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        """Cache value for ttl seconds (default: the cache-wide ttl)."""
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now)
+            expires_at = now + (self.ttl if ttl is None else ttl)
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            heapq.heappush(self._expiry, (expires_at, key))
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+            if len(self._expiry) > 2 * self.capacity:
+                # Mostly stale entries by now; rebuild from the live ones
+                self._expiry = [(entry[0], k) for k, entry in self._data.items()]
+                heapq.heapify(self._expiry)
+
+    def expires_in(self, key) -> float:
+        """Seconds until key expires (0 if missing or expired); doesn't count as a use."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return 0
+            return max(0, entry[0] - time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._expiry.clear()
+
+    def __len__(self):
+        with self._lock:
+            self._sweep(time.monotonic())
+            return len(self._data)
+
+    def _sweep(self, now: float):
+        """Drop every entry that has expired by now; caller holds the lock."""
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(expiry)
+            entry = self._data.get(key)
+            if entry is not None and entry[0] == expires_at:
+                del self._data[key]
+
+
+class UrlStore:
+    """
+    SQLite copy of the URL cache, so extracted URLs survive a restart.
+
+    Rows are keyed on (video_id, quality) and hold the cached response with
+    its wall-clock expiry (monotonic deadlines don't carry across processes).
+    url_cache stays the in-memory lookup; this is written through on every
+    extraction and read back once at startup.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS urls (
+            video_id TEXT NOT NULL,
+            quality TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (video_id, quality)
+        );
+        CREATE INDEX IF NOT EXISTS urls_expires_at ON urls (expires_at);
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        # It's only a cache: a corrupt file is moved aside and started over,
+        # and if even that fails the server runs without persistence
+        # (_conn is None) rather than refusing to start.
+        self._conn = None
+        try:
+            self._conn = self._open()
+        except sqlite3.DatabaseError as e:
+            aside = path.with_name(path.name + ".corrupt")
+            print(f"[Cache] {path.name} is unusable ({e}); moving it to {aside.name}")
+            try:
+                os.replace(path, aside)
+                for suffix in ("-wal", "-shm"):
+                    path.with_name(path.name + suffix).unlink(missing_ok=True)
+                self._conn = self._open()
+            except (OSError, sqlite3.Error) as e:
+                print(f"[Cache] Running without a persistent URL cache: {e}")
+        except (OSError, sqlite3.Error) as e:
+            print(f"[Cache] Running without a persistent URL cache: {e}")
+
+    def _open(self):
+        self.path.parent.mkdir(exist_ok=True)
+        conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+    def put(self, video_id: str, quality: str, data: dict, ttl: float):
+        if self._conn is None:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM urls WHERE expires_at <= ?", (now,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?)",
+                    (video_id, quality, now + ttl, _dumps(data)),
+                )
+        except sqlite3.Error as e:
+            print(f"[Cache] Could not persist {video_id}: {e}")
+
+    def load(self, limit: int):
+        """Yield (video_id, quality, data, ttl) for up to limit unexpired rows, soonest expiry first."""
+        if self._conn is None:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT video_id, quality, expires_at, data FROM urls"
+                    " WHERE expires_at > ? ORDER BY expires_at DESC LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"[Cache] Could not read {self.path.name}: {e}")
+            return
+        for video_id, quality, expires_at, data in reversed(rows):
+            try:
+                data = _loads(data)
+                if not isinstance(data, dict):
+                    raise TypeError(f"expected an object, got {type(data).__name__}")
+            except (ValueError, TypeError) as e:
+                # Skip the row; the next extraction of that video replaces it
+                print(f"[Cache] Skipping unreadable entry for {video_id}: {e}")
+                continue
+            yield video_id, quality, data, expires_at - now
+
+    def clear(self):
+        if self._conn is None:
+            return
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM urls")
+        except sqlite3.Error as e:
+            print(f"[Cache] Could not clear {self.path.name}: {e}")
+
+
+# Cache for video URLs. Signed YouTube URLs carry their own expiry, which
+# decides how long they are cached (see _url_ttl); CACHE_DURATION is used
+# (in seconds) for URLs without one.
+CACHE_DURATION = 3600
+MAX_CACHE_TTL = 6 * 3600
+# Stop handing out a URL this many seconds before YouTube expires it
+URL_EXPIRY_MARGIN = 30
+# expire=<unix ts> in the query string, or /expire/<unix ts>/ in manifest paths
+_EXPIRE_RE = re.compile(r"[?&/]expire[=/](\d+)")
+url_cache = LRUTTL(capacity=1024, ttl=CACHE_DURATION)
+URL_CACHE_DB = Path(SCRIPT_DIR) / "data" / "url_cache.sqlite3"
+url_store = UrlStore(URL_CACHE_DB)
+
+# Upper bound on how long a /stream request waits for yt-dlp
+EXTRACT_TIMEOUT = 30
 
 # Analytics logging
 ANALYTICS_DIR = Path(SCRIPT_DIR) / "analytics"
 ANALYTICS_DIR.mkdir(exist_ok=True)
 ANALYTICS_FILE = ANALYTICS_DIR / "viewing_log.jsonl"
 SESSIONS_FILE = ANALYTICS_DIR / "sessions.jsonl"
+STATS_CHECKPOINT_FILE = ANALYTICS_DIR / "stats.ckpt"
+
+# Weekday names indexed by struct_time.tm_wday (Monday == 0), cheaper than strftime("%A")
+_DAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+# Interned copies of the known event types. Names built at runtime (e.g.
+# f"playback_{event}") are swapped for these so every event dict and stats
+# counter shares one string object per type. Unknown names are left alone
+# rather than interned, since they come from clients and are unbounded.
+_EVENT_TYPES = {
+    event_type: sys.intern(event_type)
+    for event_type in (
+        "stream_request",
+        "stream_error",
+        "session_start",
+        "playback_play_start",
+        "playback_play_end",
+        "playback_play_pause",
+        "playback_play_resume",
+        "playback_skip",
+        "playback_replay",
+        "playback_unknown",
+    )
+}
+
+
+class BufferedJsonlWriter:
+    """
+    Append-only JSONL writer that keeps its file open and batches writes.
+
+    Request handlers only append the encoded line to an in-memory buffer; a
+    background daemon thread writes the buffer out once it reaches
+    FLUSH_BYTES or every FLUSH_INTERVAL seconds, so the handler never waits
+    on disk I/O. Call flush() before reading the file back.
+
+    The file itself is opened unbuffered since this class does the batching.
+    Flushing hands data to the OS page cache, which survives a crash of this
+    process; fsync=True additionally syncs to disk after each flush that
+    wrote something (at most every FLUSH_INTERVAL), never per event.
+    """
+
+    FLUSH_BYTES = 8192
+    FLUSH_INTERVAL = 0.5
+
+    def __init__(self, path: Path, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self._file = open(path, "ab", buffering=0)
+        self._buffer = bytearray()
+        self._buffer_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._wake = threading.Event()
+        # Local date of the oldest record in the file (None while it is
+        # empty); rotate_log() rotates and names segments by it
+        self.first_day = self._first_day_on_disk()
+
+        thread = threading.Thread(target=self._run, name=f"writer-{path.name}", daemon=True)
+        thread.start()
+        atexit.register(self.flush)
+
+    def write(self, payload: bytes):
+        """Queue one encoded JSON record; the newline is added here."""
+        with self._buffer_lock:
+            if self.first_day is None:
+                self.first_day = date.today()
+            self._buffer.extend(payload)
+            self._buffer.append(0x0A)
+            full = len(self._buffer) >= self.FLUSH_BYTES
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Write all buffered lines to disk."""
+        # Holding the I/O lock across the swap keeps lines in order
+        # when a reader flushes concurrently with the background thread.
+        with self._io_lock:
+            self._flush_locked()
+
+    def rotate(self, segment_path: Path):
+        """Move everything written so far to segment_path and start a new file."""
+        with self._io_lock:
+            self._flush_locked()
+            self._file.close()
+            os.replace(self.path, segment_path)
+            self._file = open(self.path, "ab", buffering=0)
+            with self._buffer_lock:
+                # Anything buffered since the flush above goes to the new file
+                self.first_day = date.today() if self._buffer else None
+
+    def truncate(self):
+        """Discard everything buffered or written so far, leaving an empty file."""
+        with self._io_lock:
+            with self._buffer_lock:
+                self._buffer.clear()
+                self.first_day = None
+            self._file.truncate(0)
+
+    def _first_day_on_disk(self):
+        """Date of the first record already in the file, for a log reopened after a restart."""
+        try:
+            with open(self.path, "rb") as f:
+                first = f.readline()
+            if not first:
+                return None
+            # Records carry "timestamp", except sessions' "started_at"
+            record = _loads(first)
+            return date.fromisoformat(str(record.get("timestamp") or record.get("started_at"))[:10])
+        except (OSError, ValueError, AttributeError):
+            # No usable first record: the file's age is the best remaining guess
+            return datetime.fromtimestamp(self.path.stat().st_mtime).date()
+
+    def _flush_locked(self):
+        with self._buffer_lock:
+            pending, self._buffer = self._buffer, bytearray()
+        # Raw (unbuffered) writes may be partial, so loop until all is written
+        view = memoryview(pending)
+        while view:
+            view = view[self._file.write(view):]
+        if pending and self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[Error] Failed to flush {self.path.name}: {e}")
+
+
+def log_segments(path: Path) -> list:
+    """
+    Rotated segments of a JSONL log, oldest first.
+
+    Segments are named <stem>.YYYY-MM-DD.jsonl and are gzipped in the
+    background after rotation; if both forms exist the finished .gz wins.
+    """
+    segments = {}
+    for segment in path.parent.glob(f"{path.stem}.*.jsonl*"):
+        if segment.suffix == ".jsonl":
+            segments.setdefault(segment.name, segment)
+        elif segment.suffix == ".gz":
+            segments[segment.name[:-len(".gz")]] = segment
+    return [segments[name] for name in sorted(segments)]
+
+
+def segment_day(segment: Path, path: Path) -> str:
+    """The YYYY-MM-DD date in the name of one of path's rotated segments."""
+    return segment.name[len(path.stem) + 1:][:10]
+
+
+def open_log_file(path: Path):
+    """Open a live or rotated JSONL log for binary reading."""
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+# What reading a corrupt or truncated segment can raise; gzip.BadGzipFile
+# is an OSError, a stream cut short raises EOFError or zlib.error
+_LOG_READ_ERRORS = (OSError, EOFError, zlib.error)
+
+
+def iter_log_lines(path: Path, since: str = "", skip_unreadable: bool = False):
+    """
+    Yield raw lines from every rotated segment of a log, then the live file.
+
+    If since (YYYY-MM-DD) is given, segments dated before it are skipped.
+    With skip_unreadable, a file that fails to read (e.g. a corrupt .gz) is
+    logged and the rest of it skipped instead of raising _LOG_READ_ERRORS.
+    """
+    files = [segment for segment in log_segments(path) if segment_day(segment, path) >= since]
+    if path.exists():
+        files.append(path)
+    for log_file in files:
+        try:
+            try:
+                f = open_log_file(log_file)
+            except FileNotFoundError:
+                # Segment was compressed after we listed it
+                gz_path = log_file.with_name(log_file.name + ".gz")
+                if not gz_path.exists():
+                    continue
+                f = open_log_file(gz_path)
+            with f:
+                yield from f
+        except _LOG_READ_ERRORS as e:
+            if not skip_unreadable:
+                raise
+            print(f"[Warning] Skipping unreadable {log_file.name}: {e}")
+
+
+def compress_segment(segment: Path):
+    """Gzip a rotated segment, replacing the plain file once the archive is complete."""
+    gz_path = segment.with_name(segment.name + ".gz")
+    tmp_path = segment.with_name(segment.name + ".gz.tmp")
+    try:
+        with open(segment, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=9) as dst:
+            while chunk := src.read(1 << 20):
+                dst.write(chunk)
+        os.replace(tmp_path, gz_path)
+        segment.unlink()
+        print(f"[Log] Compressed {segment.name}")
+    except OSError as e:
+        print(f"[Error] Failed to compress {segment.name}: {e}")
+
+
+def rotate_log(writer: "BufferedJsonlWriter"):
+    """
+    Roll a writer's file into a segment named after its oldest record's
+    date, once that date is before today.
+
+    The writer tracks that date itself: the file's mtime would already be
+    today if anything was flushed between midnight and this call.
+
+    Returns the new segment path, or None if nothing was rotated.
+    """
+    day = writer.first_day
+    if day is None or day >= date.today():
+        return None
+
+    segment = writer.path.with_name(f"{writer.path.stem}.{day.isoformat()}.jsonl")
+    if segment.exists() or segment.with_name(segment.name + ".gz").exists():
+        print(f"[Warning] Segment {segment.name} already exists, not rotating")
+        return None
+
+    writer.rotate(segment)
+    threading.Thread(target=compress_segment, args=(segment,), daemon=True).start()
+    return segment
+
+
+def compress_pending_segments(path: Path):
+    """Finish compressing segments left uncompressed by an earlier shutdown."""
+    for segment in path.parent.glob(f"{path.stem}.*.jsonl"):
+        if segment.with_name(segment.name + ".gz").exists():
+            segment.unlink()
+        else:
+            threading.Thread(target=compress_segment, args=(segment,), daemon=True).start()
+
+
+class StatsAggregator:
+    """
+    Running totals behind /analytics/stats.
+
+    Updated in place as each event is logged, so serving stats never has to
+    re-read the analytics log. The same add() is used to replay the log on
+    startup.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.total_events = 0
+        self.unique_videos = set()
+        self.unique_media = set()
+        self.events_by_type = Counter()
+        self.engagement_levels = Counter()
+        self.genres_watched = Counter()
+        self.media_types = {"movie": 0, "tv": 0}
+        self.qualities_requested = Counter()
+        self.hourly_distribution = Counter({str(h): 0 for h in range(24)})
+        self.daily_distribution = Counter()
+
+    def add(self, event: dict):
+        """Fold one event into the totals, skipping fields with unexpected types."""
+        with self.lock:
+            self._add(event)
+
+    def _add(self, event: dict):
+        """add() without the lock, for aggregators private to one thread."""
+        # Each field the stats use is looked up exactly once; on warmup this
+        # costs more than parsing the line itself.
+        try:
+            get = event.get  # Also rejects log lines that aren't JSON objects
+            event_type = get("event_type", "unknown")
+            video_id = get("video_id")
+            media_type = get("media_type")
+            media_id = get("media_id")
+            level = get("engagement_level")
+            genres = get("media_genres") or ()
+            if isinstance(genres, str):
+                genres = genres.split(",")
+            genres = [genre.strip() for genre in genres]
+            quality = get("quality_requested")
+            hour = get("hour_of_day")
+            day = get("day_of_week")
+            # Hash every counter key up front, so a malformed field skips
+            # the whole event instead of leaving it half counted
+            hash((event_type, media_type, level, day, *genres))
+        except (AttributeError, TypeError) as e:
+            print(f"[Warning] Malformed analytics event: {e}")
+            return
+
+        self.total_events += 1
+        self.events_by_type[event_type] += 1
+        if video_id:
+            # str() keeps the set sortable for to_checkpoint() whatever
+            # type a client sent
+            self.unique_videos.add(str(video_id))
+        if media_id:
+            self.unique_media.add(f"{media_type}_{media_id}")
+        if level:
+            self.engagement_levels[level] += 1
+        for genre in genres:
+            self.genres_watched[genre] += 1
+        if media_type in self.media_types:
+            self.media_types[media_type] += 1
+        if quality:
+            self.qualities_requested[str(quality)] += 1
+        if hour is not None:
+            self.hourly_distribution[str(hour)] += 1
+        if day:
+            self.daily_distribution[day] += 1
+
+    def merge(self, other: "StatsAggregator"):
+        """Add another aggregator's totals into this one."""
+        with self.lock:
+            self.total_events += other.total_events
+            self.unique_videos |= other.unique_videos
+            self.unique_media |= other.unique_media
+            self.events_by_type.update(other.events_by_type)
+            self.engagement_levels.update(other.engagement_levels)
+            self.genres_watched.update(other.genres_watched)
+            for media_type, count in other.media_types.items():
+                self.media_types[media_type] += count
+            self.qualities_requested.update(other.qualities_requested)
+            self.hourly_distribution.update(other.hourly_distribution)
+            self.daily_distribution.update(other.daily_distribution)
+
+    def snapshot(self) -> dict:
+        """Return the totals in the /analytics/stats response format."""
+        with self.lock:
+            return {
+                "total_events": self.total_events,
+                "unique_videos": len(self.unique_videos),
+                "unique_media": len(self.unique_media),
+                "events_by_type": dict(self.events_by_type),
+                "engagement_levels": dict(self.engagement_levels),
+                "genres_watched": dict(self.genres_watched),
+                "media_types": dict(self.media_types),
+                "qualities_requested": dict(self.qualities_requested),
+                "hourly_distribution": dict(self.hourly_distribution),
+                "daily_distribution": dict(self.daily_distribution),
+            }
+
+    def to_checkpoint(self) -> dict:
+        """Serialize the full state, including the unique-id sets."""
+        with self.lock:
+            state = self.snapshot()
+            state["unique_videos"] = sorted(self.unique_videos)
+            state["unique_media"] = sorted(self.unique_media)
+            return state
+
+    def load_checkpoint(self, state: dict):
+        """Restore state previously produced by to_checkpoint()."""
+        with self.lock:
+            self.total_events = state["total_events"]
+            self.unique_videos = set(state["unique_videos"])
+            self.unique_media = set(state["unique_media"])
+            self.events_by_type = Counter(state["events_by_type"])
+            self.engagement_levels = Counter(state["engagement_levels"])
+            self.genres_watched = Counter(state["genres_watched"])
+            self.media_types = dict(state["media_types"])
+            self.qualities_requested = Counter(state["qualities_requested"])
+            self.hourly_distribution = Counter(state["hourly_distribution"])
+            self.daily_distribution = Counter(state["daily_distribution"])
+
+
+analytics_writer = BufferedJsonlWriter(ANALYTICS_FILE)
+sessions_writer = BufferedJsonlWriter(SESSIONS_FILE)
+analytics_stats = StatsAggregator()
+
+
+def save_stats_checkpoint():
+    """
+    Persist the aggregated stats along with the log offset they cover.
+
+    Holding the stats lock while flushing keeps the offset in step with the
+    totals: log_analytics() appends and aggregates under the same lock.
+    """
+    with analytics_stats.lock:
+        analytics_writer.flush()
+        state = analytics_stats.to_checkpoint()
+        state["offset"] = ANALYTICS_FILE.stat().st_size if ANALYTICS_FILE.exists() else 0
+
+    tmp_path = STATS_CHECKPOINT_FILE.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, STATS_CHECKPOINT_FILE)
+
+
+# Warmup splits plain log files into chunks of about this size and folds
+# them into partial stats on a thread pool
+WARMUP_CHUNK_BYTES = 8 << 20
+
+
+def warm_stats():
+    """
+    Rebuild the in-memory stats on startup.
+
+    Loads the last checkpoint and replays only the live-log lines written
+    after it. Falls back to replaying every rotated segment plus the live
+    log if there is no usable checkpoint.
+    """
+    file_size = ANALYTICS_FILE.stat().st_size if ANALYTICS_FILE.exists() else 0
+    units = None
+
+    if STATS_CHECKPOINT_FILE.exists():
+        try:
+            with open(STATS_CHECKPOINT_FILE, "r") as f:
+                state = json.load(f)
+            # A checkpoint past the end of the file belongs to an older log
+            if state["offset"] <= file_size:
+                analytics_stats.load_checkpoint(state)
+                units = _partition(ANALYTICS_FILE, state["offset"], file_size)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[Warning] Ignoring stats checkpoint: {e}")
+
+    if units is None:
+        units = []
+        for segment in log_segments(ANALYTICS_FILE):
+            if segment.suffix == ".gz":
+                # gzip streams can't be seeked into, so each is one unit
+                units.append((segment, 0, None))
+            else:
+                units.extend(_partition(segment, 0, segment.stat().st_size))
+        units.extend(_partition(ANALYTICS_FILE, 0, file_size))
+
+    if len(units) == 1:
+        analytics_stats.merge(_stats_for_range(units[0]))
+    elif units:
+        # Parsing holds the GIL, but file reads and gzip decompression don't,
+        # so threads still overlap a good part of a multi-segment replay.
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor:
+            for partial in executor.map(_stats_for_range, units):
+                analytics_stats.merge(partial)
+
+    # Runs at import: a failed save must not keep the server from starting
+    try:
+        save_stats_checkpoint()
+    except (OSError, TypeError, ValueError) as e:
+        print(f"[Warning] Could not save stats checkpoint: {e}")
+
+
+def _partition(path: Path, start: int, end: int) -> list:
+    """Split path's bytes [start, end) into newline-aligned (path, start, end) ranges."""
+    if end <= start:
+        return []
+
+    bounds = [start]
+    with open(path, "rb") as f:
+        for target in range(start + WARMUP_CHUNK_BYTES, end, WARMUP_CHUNK_BYTES):
+            if target <= bounds[-1]:
+                continue
+            f.seek(target)
+            f.readline()  # Move to the start of the next line
+            if f.tell() >= end:
+                break
+            bounds.append(f.tell())
+    bounds.append(end)
+    return [(path, bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def _stats_for_range(unit) -> "StatsAggregator":
+    """Parse one (path, start, end) range into a fresh StatsAggregator."""
+    path, start, end = unit
+    partial = StatsAggregator()
+    add = partial._add  # partial is private to this thread, skip the lock
+    try:
+        with open_log_file(path) as f:
+            if start:
+                f.seek(start)
+            position = start
+            for line in f:
+                if end is not None and position >= end:
+                    break
+                position += len(line)
+                try:
+                    add(_loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except _LOG_READ_ERRORS as e:
+        # Runs at import: an unreadable segment is left out, not fatal
+        print(f"[Warning] Skipping unreadable {path.name}: {e}")
+        return StatsAggregator()
+    return partial
+
+
+warm_stats()
+atexit.register(save_stats_checkpoint)
 
 
 def log_analytics(event_type: str, data: dict):
@@ -82,98 +879,255 @@ def log_analytics(event_type: str, data: dict):
     Events are stored in JSON Lines format (one JSON object per line)
     for easy processing and analysis later.
     """
+    event_type = _EVENT_TYPES.get(event_type, event_type)
+    t = time.time()
+    local = time.localtime(t)
     event = {
-        "timestamp": datetime.now().isoformat(),
-        "timestamp_unix": datetime.now().timestamp(),
+        "timestamp": datetime.fromtimestamp(t).isoformat(),
+        "timestamp_unix": t,
         "event_type": event_type,
-        "day_of_week": datetime.now().strftime("%A"),
-        "hour_of_day": datetime.now().hour,
+        "day_of_week": _DAYS[local.tm_wday],
+        "hour_of_day": local.tm_hour,
         "source_ip": request.remote_addr if request else None,
         **data
     }
 
-    with open(ANALYTICS_FILE, "a") as f:
-        f.write(json.dumps(event) + "\n")
+    payload = _dumps(event)
+    with analytics_stats.lock:
+        analytics_writer.write(payload)
+        analytics_stats.add(event)
 
     print(f"[Analytics] {event_type}: {data.get('video_id', data.get('media_title', 'unknown'))}")
 
 
 def log_session(session_data: dict):
     """Log session information."""
-    with open(SESSIONS_FILE, "a") as f:
-        f.write(json.dumps(session_data) + "\n")
+    sessions_writer.write(_dumps(session_data))
+
+
+# yt-dlp format selector for each supported quality preference. AVPlayer
+# needs a single muxed stream, so each one prefers an mp4 with both audio
+# and video, then any muxed format. b/w never pick separate video+audio
+# formats to merge, so info["url"] is always the stream to play.
+_MUXED_MP4 = "[ext=mp4][acodec!=none][vcodec!=none]"
+_FORMAT_SELECTORS = {
+    "best": f"b{_MUXED_MP4}/b",
+    "1080": f"b{_MUXED_MP4}[height<=1080]/b[height<=1080]/b",
+    "720": f"b{_MUXED_MP4}[height<=720]/b[height<=720]/b",
+    "480": f"b{_MUXED_MP4}[height<=480]/b[height<=480]/b",
+    "worst": f"w{_MUXED_MP4}/w",
+}
+
+# The ios client returns URLs that need no signature/nsig deciphering, so
+# extraction skips the web player JS; web is the fallback when ios fails
+YOUTUBE_PLAYER_CLIENTS = ["ios", "web"]
+# Per-socket timeout for yt-dlp's HTTP requests, so one stalled connection
+# fails fast instead of using up all of EXTRACT_TIMEOUT
+SOCKET_TIMEOUT = 10
+
+# Options shared by every in-process YoutubeDL instance
+_YDL_OPTS_BASE = {
+    "quiet": True,
+    "no_warnings": True,
+    "noplaylist": True,
+    "skip_download": True,
+    "extractor_args": {"youtube": {"player_client": YOUTUBE_PLAYER_CLIENTS}},
+    "socket_timeout": SOCKET_TIMEOUT,
+}
+
+# Long-lived YoutubeDL instances, so yt-dlp's option parsing and extractor
+# setup happen once instead of per request. YoutubeDL isn't thread-safe, so
+# each extraction worker thread keeps its own format_selector -> instance map
+# rather than sharing one per quality behind a lock that would serialize
+# concurrent extractions.
+_ydl_local = threading.local()
+
+
+def _get_ydl(format_selector: str):
+    """Return this thread's YoutubeDL instance for format_selector."""
+    instances = getattr(_ydl_local, "instances", None)
+    if instances is None:
+        instances = _ydl_local.instances = {}
+    ydl = instances.get(format_selector)
+    if ydl is None:
+        ydl = instances[format_selector] = YoutubeDL({**_YDL_OPTS_BASE, "format": format_selector})
+    return ydl
+
+
+# Executable fallback arguments that don't depend on the request
+_YTDLP_ARGS = (
+    "-j",  # JSON output
+    "--no-playlist",
+    "--no-warnings",
+    "--extractor-args", "youtube:player_client=" + ",".join(YOUTUBE_PLAYER_CLIENTS),
+    "--socket-timeout", str(SOCKET_TIMEOUT),
+)
+
+
+def extract_info(youtube_url: str, format_selector: str) -> dict:
+    """
+    Run yt-dlp on youtube_url and return its info dict.
+
+    Uses the in-process library when available, otherwise the yt-dlp
+    executable. Raises DownloadError if yt-dlp reports an error.
+    """
+    if YoutubeDL is not None:
+        return _get_ydl(format_selector).extract_info(youtube_url, download=False)
+
+    # run() is Popen + communicate() on raw pipes, and it kills and reaps
+    # the child on timeout. env is left unset so the child inherits ours
+    # as-is; passing a dict would rebuild its environment block every call.
+    result = subprocess.run(
+        [YTDLP_PATH, "-f", format_selector, *_YTDLP_ARGS, youtube_url],
+        capture_output=True,
+        timeout=EXTRACT_TIMEOUT
+    )
+
+    if result.returncode != 0:
+        raise DownloadError(result.stderr.decode(errors="replace").strip() or "Unknown error")
+
+    # Parsed straight from the bytes; only stderr ever needs decoding
+    return _loads(result.stdout)
+
+
+# Extractions run on this pool; _inflight maps cache_key -> Future so that
+# concurrent misses for the same video share a single yt-dlp run.
+_extract_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="extract")
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# Background refresh: URLs requested in the last REFRESH_RECENT seconds are
+# re-extracted once they are within REFRESH_AHEAD seconds of leaving the
+# cache, so trailers people keep opening never take a synchronous miss.
+# Entries nobody asks for age out of _last_requested and simply expire.
+REFRESH_INTERVAL = 10
+REFRESH_AHEAD = 60
+REFRESH_RECENT = 3600
+# Refreshes submitted per pass, leaving extraction workers for /stream
+REFRESH_MAX = 4
+_last_requested = {}  # cache_key -> time.monotonic() of the last request
+_last_requested_lock = threading.Lock()
+
+# Any public video works; it only has to make yt-dlp load the YouTube
+# extractor and fetch and cache the player JS.
+WARMUP_URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+def prewarm_extractor():
+    """
+    Run a throwaway extraction in the background so the first real request
+    doesn't pay for extractor import and player JS setup.
+
+    It runs on _extract_executor so the YoutubeDL instance it warms up
+    belongs to a worker that will serve requests. Failures (e.g. starting
+    offline) are only logged.
+    """
+    if YoutubeDL is None:
+        return
+
+    def warm():
+        try:
+            _get_ydl(_FORMAT_SELECTORS["best"]).extract_info(WARMUP_URL, download=False, process=False)
+            print("[Warmup] yt-dlp extractor ready")
+        except Exception as e:
+            print(f"[Warmup] Skipped: {e}")
+
+    _extract_executor.submit(warm)
+
+
+def _url_ttl(video_url: str) -> float:
+    """Seconds video_url may be cached: until shortly before its signed expiry, capped at MAX_CACHE_TTL."""
+    match = _EXPIRE_RE.search(video_url)
+    if not match:
+        return CACHE_DURATION
+    return min(int(match.group(1)) - time.time() - URL_EXPIRY_MARGIN, MAX_CACHE_TTL)
+
+
+def _cache_key(video_id: str, quality: str) -> tuple:
+    """url_cache key for a request; qualities without a selector share the "best" entry."""
+    return (video_id, quality if quality in _FORMAT_SELECTORS else "best")
+
+
+def load_url_cache():
+    """Refill url_cache from url_store, e.g. after a restart."""
+    loaded = 0
+    for video_id, quality, data, ttl in url_store.load(url_cache.capacity):
+        url_cache.set(_cache_key(video_id, quality), data, ttl=ttl)
+        loaded += 1
+    if loaded:
+        print(f"[Cache] Restored {loaded} URLs from {URL_CACHE_DB.name}")
+
+
+load_url_cache()
 
 
 def get_video_url(video_id: str, quality: str = "best") -> dict:
     """
     Extract direct video URL from YouTube using yt-dlp.
 
+    Cache misses are coalesced: if an extraction for the same video and
+    quality is already running, this waits for its result instead of
+    starting another one.
+
     Args:
         video_id: YouTube video ID
-        quality: Quality preference (best, 1080, 720, 480, worst)
+        quality: Quality preference (best, 1080, 720, 480, worst); anything
+            else is treated as best
 
     Returns:
         dict with 'url' and 'title' keys, or 'error' key on failure
     """
     # Check cache
-    cache_key = f"{video_id}_{quality}"
-    if cache_key in url_cache:
-        cached_time, cached_data = url_cache[cache_key]
-        if datetime.now() - cached_time < CACHE_DURATION:
-            print(f"[Cache Hit] {video_id}")
-            return {**cached_data, "cache_hit": True}
+    cache_key = _cache_key(video_id, quality)
+    quality = cache_key[1]
+    with _last_requested_lock:
+        _last_requested[cache_key] = time.monotonic()
+    cached_data = url_cache.get(cache_key)
+    if cached_data is not None:
+        print(f"[Cache Hit] {video_id}")
+        return {**cached_data, "cache_hit": True}
+
+    with _inflight_lock:
+        future = _inflight.get(cache_key)
+        if future is None:
+            # An extraction may have finished (cached, then left _inflight)
+            # between the cache check above and taking the lock
+            cached_data = url_cache.get(cache_key)
+            if cached_data is not None:
+                print(f"[Cache Hit] {video_id}")
+                return {**cached_data, "cache_hit": True}
+            future = _extract_executor.submit(_fetch_video_url, video_id, quality, cache_key)
+            _inflight[cache_key] = future
+        else:
+            print(f"[Coalesced] {video_id}")
 
-    youtube_url = f"https://www.youtube.com/watch?v={video_id}"
+    try:
+        return dict(future.result(timeout=EXTRACT_TIMEOUT))
+    except FutureTimeoutError:
+        print(f"[Error] Timeout for {video_id}")
+        return {"error": "Request timed out"}
 
-    # Build format selector based on quality preference
-    if quality == "best":
-        format_selector = "best[ext=mp4]/best"
-    elif quality == "1080":
-        format_selector = "best[height<=1080][ext=mp4]/best[height<=1080]/best"
-    elif quality == "720":
-        format_selector = "best[height<=720][ext=mp4]/best[height<=720]/best"
-    elif quality == "480":
-        format_selector = "best[height<=480][ext=mp4]/best[height<=480]/best"
-    else:
-        format_selector = "worst[ext=mp4]/worst"
 
+def _fetch_video_url(video_id: str, quality: str, cache_key: tuple) -> dict:
+    """Run the extraction for get_video_url and cache the result."""
     try:
-        # Run yt-dlp to get video info
-        result = subprocess.run(
-            [
-                YTDLP_PATH,
-                "-f", format_selector,
-                "-j",  # JSON output
-                "--no-playlist",
-                "--no-warnings",
-                youtube_url
-            ],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-
-        if result.returncode != 0:
-            error_msg = result.stderr.strip() or "Unknown error"
-            print(f"[Error] yt-dlp failed for {video_id}: {error_msg}")
-            return {"error": error_msg}
-
-        # Parse JSON output
-        info = json.loads(result.stdout)
+        return _extract_video_url(video_id, quality, cache_key)
+    finally:
+        # Cached (or failed) by now, so later callers no longer need to wait on us
+        with _inflight_lock:
+            _inflight.pop(cache_key, None)
 
-        video_url = info.get("url")
-        if not video_url:
-            # Sometimes the URL is in requested_formats
-            formats = info.get("requested_formats", [])
-            if formats:
-                # Prefer format with both video and audio
-                for fmt in formats:
-                    if fmt.get("acodec") != "none" and fmt.get("vcodec") != "none":
-                        video_url = fmt.get("url")
-                        break
-                if not video_url:
-                    video_url = formats[0].get("url")
 
+def _extract_video_url(video_id: str, quality: str, cache_key: tuple) -> dict:
+    """Extract and cache the stream URL; returns an 'error' dict on failure."""
+    youtube_url = f"https://www.youtube.com/watch?v={video_id}"
+    format_selector = _FORMAT_SELECTORS[quality]
+
+    try:
+        info = extract_info(youtube_url, format_selector)
+
+        # The selectors only pick single muxed formats (no requested_formats)
+        video_url = info.get("url")
         if not video_url:
             return {"error": "No video URL found"}
 
@@ -194,11 +1148,18 @@ def get_video_url(video_id: str, quality: str = "best") -> dict:
         }
 
         # Cache the result
-        url_cache[cache_key] = (datetime.now(), response_data)
+        ttl = _url_ttl(video_url)
+        if ttl > 0:
+            url_cache.set(cache_key, response_data, ttl=ttl)
+            url_store.put(video_id, quality, response_data, ttl)
 
         print(f"[OK] {video_id} -> {info.get('height', '?')}p")
         return response_data
 
+    except DownloadError as e:
+        error_msg = str(e) or "Unknown error"
+        print(f"[Error] yt-dlp failed for {video_id}: {error_msg}")
+        return {"error": error_msg}
     except subprocess.TimeoutExpired:
         print(f"[Error] Timeout for {video_id}")
         return {"error": "Request timed out"}
@@ -210,6 +1171,46 @@ def get_video_url(video_id: str, quality: str = "best") -> dict:
         return {"error": str(e)}
 
 
+def refresh_expiring_urls():
+    """Start re-extracting recently requested URLs that are about to leave the cache."""
+    now = time.monotonic()
+    with _last_requested_lock:
+        for cache_key, requested_at in list(_last_requested.items()):
+            if now - requested_at > REFRESH_RECENT:
+                del _last_requested[cache_key]
+        # Most recently requested first, so those win when REFRESH_MAX is hit
+        recent = sorted(_last_requested, key=_last_requested.get, reverse=True)
+
+    submitted = 0
+    for cache_key in recent:
+        if submitted >= REFRESH_MAX:
+            break
+        remaining = url_cache.expires_in(cache_key)
+        if not 0 < remaining <= REFRESH_AHEAD:
+            continue
+        with _inflight_lock:
+            if cache_key in _inflight:
+                continue
+            # Registered in _inflight like any miss, so /stream requests
+            # arriving meanwhile wait for this extraction
+            _inflight[cache_key] = _extract_executor.submit(_fetch_video_url, *cache_key, cache_key)
+        print(f"[Refresh] {cache_key[0]} ({int(remaining)}s left)")
+        submitted += 1
+
+
+def _refresh_loop():
+    """Background thread: refresh_expiring_urls every REFRESH_INTERVAL seconds."""
+    while True:
+        time.sleep(REFRESH_INTERVAL)
+        try:
+            refresh_expiring_urls()
+        except Exception as e:
+            print(f"[Refresh] Error: {e}")
+
+
+threading.Thread(target=_refresh_loop, name="url-refresh", daemon=True).start()
+
+
 @app.route("/")
 def index():
     """Health check and usage info."""
@@ -219,13 +1220,18 @@ def index():
         "usage": {
             "stream": "/stream/<video_id>",
             "stream_with_quality": "/stream/<video_id>?quality=720",
+            "stream_redirect": "/stream/<video_id>?redirect=1",
             "log_event": "POST /analytics/event",
             "view_stats": "/analytics/stats",
         },
-        "qualities": ["best", "1080", "720", "480", "worst"],
+        "qualities": list(_FORMAT_SELECTORS),
     })
 
 
+# YouTube video IDs are exactly 11 URL-safe base64 characters
+_VIDEO_ID_RE = re.compile(r"[A-Za-z0-9_-]{11}")
+
+
 @app.route("/stream/<video_id>")
 def stream(video_id: str):
     """
@@ -234,6 +1240,8 @@ def stream(video_id: str):
     Args:
         video_id: YouTube video ID (e.g., dQw4w9WgXcQ)
         quality: Optional query param (best, 1080, 720, 480, worst)
+        redirect: "1" to answer with a 302 to the stream URL instead of JSON,
+            so a player can open /stream/<id>?redirect=1 directly
 
     Additional query params for analytics (all optional):
         session_id: Unique session identifier
@@ -250,12 +1258,18 @@ def stream(video_id: str):
         total_trailers: Total number of trailers available
 
     Returns:
-        JSON with 'url' key or 'error' key
+        JSON with 'url' key or 'error' key (or a redirect, see above)
+
+    This view is deliberately synchronous. Extraction already runs on
+    _extract_executor and the server handles each request on its own
+    thread, so a slow yt-dlp call only occupies this request's thread. An
+    async view under WSGI would just run its own event loop in that same
+    thread.
     """
     quality = request.args.get("quality", "best")
 
-    # Validate video_id (basic check)
-    if not video_id or len(video_id) < 5 or len(video_id) > 20:
+    # Reject malformed IDs before they reach yt-dlp or the cache
+    if not _VIDEO_ID_RE.fullmatch(video_id):
         return jsonify({"error": "Invalid video ID"}), 400
 
     result = get_video_url(video_id, quality)
@@ -298,7 +1312,25 @@ def stream(video_id: str):
         "total_trailers": request.args.get("total_trailers"),
     })
 
-    return jsonify(result)
+    ttl = int(url_cache.expires_in(_cache_key(video_id, quality)))
+    if request.args.get("redirect") == "1":
+        return Response(status=302, headers={"Location": result["url"], **_cache_headers(ttl)})
+
+    resp = jsonify(result)
+    resp.headers.update(_cache_headers(ttl))
+    # Tag the stream URL itself: a cached copy stays valid until re-extraction
+    resp.set_etag(f"{video_id}-{quality}-{hashlib.blake2s(result['url'].encode(), digest_size=8).hexdigest()}")
+    return resp.make_conditional(request)
+
+
+def _cache_headers(ttl: int) -> dict:
+    """Client caching headers for a stream URL that stays cached for ttl more seconds."""
+    if ttl <= 0:
+        return {"Cache-Control": "no-store"}
+    return {
+        "Cache-Control": f"public, max-age={ttl}",
+        "Expires": formatdate(time.time() + ttl, usegmt=True),
+    }
 
 
 @app.route("/analytics/event", methods=["POST"])
@@ -332,7 +1364,7 @@ def log_event():
     }
     """
     try:
-        data = request.get_json()
+        data = request.get_json(force=True, cache=True)
         if not data:
             return jsonify({"error": "No JSON data provided"}), 400
 
@@ -386,7 +1418,7 @@ def start_session():
     }
     """
     try:
-        data = request.get_json() or {}
+        data = request.get_json(force=True, silent=True, cache=True) or {}
 
         session_id = str(uuid.uuid4())
         started_at = datetime.now().isoformat()
@@ -420,70 +1452,7 @@ def get_stats():
     Get basic analytics statistics.
     """
     try:
-        stats = {
-            "total_events": 0,
-            "unique_videos": set(),
-            "unique_media": set(),
-            "events_by_type": {},
-            "engagement_levels": {},
-            "genres_watched": {},
-            "media_types": {"movie": 0, "tv": 0},
-            "qualities_requested": {},
-            "hourly_distribution": {str(h): 0 for h in range(24)},
-            "daily_distribution": {},
-        }
-
-        if ANALYTICS_FILE.exists():
-            with open(ANALYTICS_FILE, "r") as f:
-                for line in f:
-                    try:
-                        event = json.loads(line)
-                        stats["total_events"] += 1
-
-                        event_type = event.get("event_type", "unknown")
-                        stats["events_by_type"][event_type] = stats["events_by_type"].get(event_type, 0) + 1
-
-                        if event.get("video_id"):
-                            stats["unique_videos"].add(event["video_id"])
-
-                        if event.get("media_id"):
-                            stats["unique_media"].add(f"{event.get('media_type')}_{event['media_id']}")
-
-                        if event.get("engagement_level"):
-                            level = event["engagement_level"]
-                            stats["engagement_levels"][level] = stats["engagement_levels"].get(level, 0) + 1
-
-                        if event.get("media_genres"):
-                            genres = event["media_genres"]
-                            if isinstance(genres, str):
-                                genres = genres.split(",")
-                            for genre in genres:
-                                genre = genre.strip()
-                                stats["genres_watched"][genre] = stats["genres_watched"].get(genre, 0) + 1
-
-                        if event.get("media_type") in stats["media_types"]:
-                            stats["media_types"][event["media_type"]] += 1
-
-                        if event.get("quality_requested"):
-                            q = str(event["quality_requested"])
-                            stats["qualities_requested"][q] = stats["qualities_requested"].get(q, 0) + 1
-
-                        if event.get("hour_of_day") is not None:
-                            h = str(event["hour_of_day"])
-                            stats["hourly_distribution"][h] = stats["hourly_distribution"].get(h, 0) + 1
-
-                        if event.get("day_of_week"):
-                            d = event["day_of_week"]
-                            stats["daily_distribution"][d] = stats["daily_distribution"].get(d, 0) + 1
-
-                    except json.JSONDecodeError:
-                        continue
-
-        # Convert sets to counts
-        stats["unique_videos"] = len(stats["unique_videos"])
-        stats["unique_media"] = len(stats["unique_media"])
-
-        return jsonify(stats)
+        return jsonify(analytics_stats.snapshot())
 
     except Exception as e:
         print(f"[Error] Failed to get stats: {e}")
@@ -494,27 +1463,52 @@ def get_stats():
 def export_analytics():
     """
     Export all analytics data as JSON array.
-    """
-    try:
-        events = []
-        if ANALYTICS_FILE.exists():
-            with open(ANALYTICS_FILE, "r") as f:
-                for line in f:
-                    try:
-                        events.append(json.loads(line))
-                    except json.JSONDecodeError:
-                        continue
 
-        return jsonify({
-            "total_events": len(events),
-            "exported_at": datetime.now().isoformat(),
-            "events": events
-        })
+    The stored JSONL lines are already JSON objects, so they are streamed
+    straight into the response array without being parsed and re-encoded.
+    total_events comes last because it is only known once every line is sent.
 
+    A read error before the first chunk is ready still returns a 500. After
+    that the status is already sent, so the stream is cut off instead and
+    the client gets invalid JSON, never a complete-looking partial export.
+    """
+    analytics_writer.flush()
+    exported_at = datetime.now().isoformat()
+
+    def generate():
+        chunk = bytearray(b'{"exported_at":"' + exported_at.encode() + b'","events":[')
+        total = 0
+        try:
+            for line in iter_log_lines(ANALYTICS_FILE):
+                line = line.strip()
+                # Cheap sanity check in place of parsing; skips blank and torn lines
+                if not (line.startswith(b"{") and line.endswith(b"}")):
+                    continue
+                if total:
+                    chunk += b","
+                chunk += line
+                total += 1
+                if len(chunk) >= 1 << 16:
+                    yield bytes(chunk)
+                    chunk.clear()
+        except Exception as e:
+            print(f"[Error] Failed to export: {e}")
+            raise
+        chunk += b'],"total_events":' + str(total).encode() + b"}"
+        yield bytes(chunk)
+
+    body = generate()
+    try:
+        first = next(body)
     except Exception as e:
-        print(f"[Error] Failed to export: {e}")
         return jsonify({"error": str(e)}), 500
 
+    def resume():
+        yield first
+        yield from body
+
+    return Response(stream_with_context(resume()), mimetype="application/json")
+
 
 # =============================================================================
 # WATCHLIST ENDPOINTS
@@ -523,45 +1517,146 @@ def export_analytics():
 WATCHLIST_DIR = Path(SCRIPT_DIR) / "data"
 WATCHLIST_DIR.mkdir(exist_ok=True)
 WATCHLIST_FILE = WATCHLIST_DIR / "watchlist.jsonl"
+WATCHLIST_SNAPSHOT_FILE = WATCHLIST_DIR / "watchlist.snapshot.json"
+# Not fsynced: compaction snapshots are fsynced and atomically renamed,
+# which bounds what an OS crash can lose
+watchlist_writer = BufferedJsonlWriter(WATCHLIST_FILE)
 
+# Compact the watchlist log into a snapshot once it grows past this size,
+# checking every WATCHLIST_COMPACT_INTERVAL seconds
+WATCHLIST_COMPACT_BYTES = 1 << 20
+WATCHLIST_COMPACT_INTERVAL = 600
 
-def get_watchlist_items(device_id: str) -> dict:
+
+# Current watchlist per device: device_id -> media_key -> latest "add" entry
+WATCHLIST_STATE = defaultdict(dict)
+watchlist_lock = threading.RLock()
+
+
+# What a hand-edited or corrupt snapshot or log line can raise while being
+# parsed and applied; such input is skipped rather than failing startup
+_MALFORMED_WATCHLIST = (ValueError, KeyError, TypeError, AttributeError)
+
+
+def _apply_watchlist_entry(entry: dict):
+    """Apply one logged add/remove action to WATCHLIST_STATE."""
+    key = f"{entry['media_type']}_{entry['media_id']}"
+    with watchlist_lock:
+        if entry.get("action") == "add":
+            WATCHLIST_STATE[entry.get("device_id")][key] = entry
+        elif entry.get("action") == "remove":
+            items = WATCHLIST_STATE.get(entry.get("device_id"))
+            if items is not None:
+                items.pop(key, None)
+
+
+def load_watchlist_state():
     """
-    Get current watchlist state for a device.
-    Returns dict of media_key -> entry for items currently on watchlist.
-    Processes add/remove actions to compute final state.
+    Build WATCHLIST_STATE once at startup.
+
+    Starts from the last compaction snapshot, if any, and replays the
+    actions logged since it was taken.
+    """
+    since = ""
+    if WATCHLIST_SNAPSHOT_FILE.exists():
+        try:
+            with open(WATCHLIST_SNAPSHOT_FILE, "rb") as f:
+                snapshot = _loads(f.read())
+            # Validated in full before use, so a bad snapshot can't leave
+            # half of itself in WATCHLIST_STATE
+            devices = {device_id: dict(items) for device_id, items in snapshot["devices"].items()}
+            # Compaction deletes older segments; any that survive (e.g. one
+            # still being gzipped at the time) are already in the snapshot
+            compacted_on = date.fromtimestamp(snapshot["compacted_at"]).isoformat()
+        except (OSError,) + _MALFORMED_WATCHLIST as e:
+            print(f"[Warning] Ignoring watchlist snapshot: {e}")
+        else:
+            with watchlist_lock:
+                WATCHLIST_STATE.update(devices)
+            since = compacted_on
+
+    # Runs at import: an unreadable segment loses its entries, not startup
+    for line in iter_log_lines(WATCHLIST_FILE, since=since, skip_unreadable=True):
+        try:
+            _apply_watchlist_entry(_loads(line))
+        except _MALFORMED_WATCHLIST:
+            continue
+
+
+def compact_watchlist():
+    """
+    Replace the watchlist log with a snapshot of the current state.
+
+    The snapshot is written atomically (temp file, fsync, rename) before the
+    live log is emptied and rotated segments are deleted, so a crash at any
+    point still leaves enough on disk to rebuild the state.
     """
-    items = {}
+    with watchlist_lock:
+        snapshot = {
+            "compacted_at": time.time(),
+            "devices": {device_id: items for device_id, items in WATCHLIST_STATE.items() if items},
+        }
+        tmp_path = WATCHLIST_SNAPSHOT_FILE.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(_dumps(snapshot))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, WATCHLIST_SNAPSHOT_FILE)
+
+        watchlist_writer.truncate()
+        for segment in WATCHLIST_DIR.glob(f"{WATCHLIST_FILE.stem}.*.jsonl*"):
+            segment.unlink()
+
+    print(f"[Watchlist] Compacted log into snapshot ({len(snapshot['devices'])} devices)")
 
+
+def _watchlist_log_bytes() -> int:
+    files = log_segments(WATCHLIST_FILE)
     if WATCHLIST_FILE.exists():
-        with open(WATCHLIST_FILE, "r") as f:
-            for line in f:
-                try:
-                    entry = json.loads(line)
-                    if entry.get("device_id") == device_id:
-                        key = f"{entry['media_type']}_{entry['media_id']}"
-                        if entry.get("action") == "add":
-                            items[key] = entry
-                        elif entry.get("action") == "remove":
-                            items.pop(key, None)
-                except json.JSONDecodeError:
-                    continue
+        files.append(WATCHLIST_FILE)
+    return sum(f.stat().st_size for f in files)
+
 
-    return items
+def _watchlist_compaction_loop():
+    """Compact the watchlist log whenever it has grown past WATCHLIST_COMPACT_BYTES."""
+    while True:
+        try:
+            if _watchlist_log_bytes() > WATCHLIST_COMPACT_BYTES:
+                compact_watchlist()
+        except Exception as e:
+            print(f"[Error] Watchlist compaction failed: {e}")
+        time.sleep(WATCHLIST_COMPACT_INTERVAL)
+
+
+load_watchlist_state()
+threading.Thread(target=_watchlist_compaction_loop, name="watchlist-compaction", daemon=True).start()
+
+
+def get_watchlist_items(device_id: str) -> dict:
+    """
+    Get current watchlist state for a device.
+    Returns a copy of the media_key -> entry dict for items currently on watchlist.
+    """
+    with watchlist_lock:
+        return dict(WATCHLIST_STATE.get(device_id, {}))
 
 
 def log_watchlist_action(action: str, data: dict):
     """Log a watchlist action (add/remove) to the JSONL file."""
+    t = time.time()
     event = {
-        "timestamp": datetime.now().isoformat(),
-        "timestamp_unix": datetime.now().timestamp(),
+        "timestamp": datetime.fromtimestamp(t).isoformat(),
+        "timestamp_unix": t,
         "action": action,
         "source_ip": request.remote_addr if request else None,
         **data
     }
 
-    with open(WATCHLIST_FILE, "a") as f:
-        f.write(json.dumps(event) + "\n")
+    payload = _dumps(event)
+    with watchlist_lock:
+        # Applied first: an entry the state rejects is never logged
+        _apply_watchlist_entry(event)
+        watchlist_writer.write(payload)
 
     print(f"[Watchlist] {action}: {data.get('media_title', data.get('media_id', 'unknown'))}")
 
@@ -580,7 +1675,7 @@ def watchlist_add():
     }
     """
     try:
-        data = request.get_json()
+        data = request.get_json(force=True, cache=True)
         if not data:
             return jsonify({"error": "No JSON data provided"}), 400
 
@@ -593,6 +1688,14 @@ def watchlist_add():
         if data.get("media_type") not in ["movie", "tv"]:
             return jsonify({"error": "media_type must be 'movie' or 'tv'"}), 400
 
+        if not isinstance(data["device_id"], str):
+            return jsonify({"error": "device_id must be a string"}), 400
+
+        # Wider integers don't survive orjson: it parses them as floats
+        media_id = data["media_id"]
+        if not isinstance(media_id, int) or isinstance(media_id, bool) or abs(media_id) > MAX_LOGGED_INT:
+            return jsonify({"error": "media_id must be an integer within 64 bits"}), 400
+
         # Log the add action
         log_watchlist_action("add", data)
 
@@ -623,6 +1726,9 @@ def watchlist_remove(media_type: str, media_id: int):
         if media_type not in ["movie", "tv"]:
             return jsonify({"error": "media_type must be 'movie' or 'tv'"}), 400
 
+        if media_id > MAX_LOGGED_INT:
+            return jsonify({"error": "media_id out of range"}), 400
+
         # Log the remove action
         log_watchlist_action("remove", {
             "media_id": media_id,
@@ -657,9 +1763,9 @@ def watchlist_check(media_type: str, media_id: int):
         if media_type not in ["movie", "tv"]:
             return jsonify({"error": "media_type must be 'movie' or 'tv'"}), 400
 
-        items = get_watchlist_items(device_id)
         key = f"{media_type}_{media_id}"
-        is_on_watchlist = key in items
+        with watchlist_lock:
+            is_on_watchlist = key in WATCHLIST_STATE.get(device_id, {})
 
         return jsonify({
             "is_on_watchlist": is_on_watchlist,
@@ -708,16 +1814,66 @@ def watchlist_list():
         return jsonify({"error": str(e)}), 500
 
 
+# =============================================================================
+# LOG ROTATION
+# =============================================================================
+
+def rotate_logs():
+    """Roll over every log holding records from before today."""
+    # The stats checkpoint offset refers to the live analytics file, so it
+    # has to be reset in the same critical section as the rotation.
+    with analytics_stats.lock:
+        if rotate_log(analytics_writer):
+            save_stats_checkpoint()
+    rotate_log(sessions_writer)
+    # Keeps rotation from interleaving with a watchlist compaction
+    with watchlist_lock:
+        rotate_log(watchlist_writer)
+
+
+def _rotation_loop():
+    """Rotate logs shortly after each local midnight."""
+    while True:
+        now = datetime.now()
+        next_midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        time.sleep((next_midnight - now).total_seconds() + 1)
+        try:
+            rotate_logs()
+        except Exception as e:
+            print(f"[Error] Log rotation failed: {e}")
+
+
+for _log_path in (ANALYTICS_FILE, SESSIONS_FILE, WATCHLIST_FILE):
+    compress_pending_segments(_log_path)
+rotate_logs()
+threading.Thread(target=_rotation_loop, name="log-rotation", daemon=True).start()
+
+
 @app.route("/clear-cache")
 def clear_cache():
     """Clear the URL cache."""
     url_cache.clear()
+    url_store.clear()
     return jsonify({"status": "cache cleared"})
 
 
+@lru_cache(maxsize=1)
 def get_local_ip():
-    """Get the local IP address of this machine."""
+    """
+    Get the local IP address of this machine.
+
+    Tries the hostname's addresses first, which needs no socket. Many
+    systems map the hostname to a loopback address only; then the UDP
+    "connect" picks the interface with the default route without sending
+    anything. Cached, so either lookup happens once.
+    """
     import socket
+    try:
+        for ip in socket.gethostbyname_ex(socket.gethostname())[2]:
+            if not ip.startswith("127."):
+                return ip
+    except Exception:
+        pass
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(("8.8.8.8", 80))
@@ -732,8 +1888,15 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="YouTube URL Extraction Server")
     parser.add_argument("--host", default="0.0.0.0", help="Host to bind to (default: 0.0.0.0)")
     parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+    parser.add_argument("--threads", type=int, default=16, help="Worker threads when served by waitress (default: 16)")
     args = parser.parse_args()
 
+    try:
+        from waitress import serve
+    except ImportError:
+        serve = None
+
+    prewarm_extractor()
     local_ip = get_local_ip()
 
     print("=" * 60)
@@ -743,7 +1906,20 @@ if __name__ == "__main__":
     print(f"  Network access: http://{local_ip}:{args.port}/")
     print(f"\n  Configure your tvOS app with: {local_ip}")
     print(f"\n  Analytics stored in: {ANALYTICS_DIR}")
+    if serve is not None:
+        print(f"  Serving with waitress ({args.threads} threads)")
+    else:
+        print("  Serving with Flask dev server (pip3 install waitress for production)")
     print("\n  Press Ctrl+C to stop the server")
     print("=" * 60 + "\n")
 
-    app.run(host=args.host, port=args.port, debug=False)
+    # Handlers run concurrently under either server; shared state (log
+    # writers, stats, watchlist, url_cache, in-flight extractions) is
+    # guarded by its own lock. waitress keeps HTTP/1.1 connections alive;
+    # channel_timeout holds idle ones open long enough for the app's next
+    # tap to reuse its connection instead of reconnecting.
+    if serve is not None:
+        serve(app, host=args.host, port=args.port, threads=args.threads,
+              connection_limit=512, channel_timeout=300)
+    else:
+        app.run(host=args.host, port=args.port, debug=False, threaded=True)